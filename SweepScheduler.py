@@ -0,0 +1,209 @@
+#-
+# Copyright (c) 2017 Jonathan Woodruff
+# Copyright (c) 2017 Alexandre Joannou
+# All rights reserved.
+# 
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory (Department of Computer Science and
+# Technology) under DARPA contract HR0011-18-C-0016 ("ECATS"), as part of the
+# DARPA SSITH research programme.
+#
+# @BERI_LICENSE_HEADER_START@
+#
+# Licensed to BERI Open Systems C.I.C. (BERI) under one or more contributor
+# license agreements.  See the NOTICE file distributed with this work for
+# additional information regarding copyright ownership.  BERI licenses this
+# file to you under the BERI Hardware-Software License, Version 1.0 (the
+# "License"); you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at:
+#
+#   http://www.beri-open-systems.org/legal/license-1-0.txt
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @BERI_LICENSE_HEADER_END@
+#
+
+import os
+import time
+import threading
+import multiprocessing
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# cost model constants, calibrated on CPython 3.11 running simulateTags.py
+# (pypy is faster, which only scales runtimes and does not change the packing)
+interpreterBytes  = 64*2**20 # interpreter, TagCache import and csv reader
+cacheLineBytes    = 384      # one Cache.Record with its dataLineAccessed set
+memSize           = 2**30    # simulateTags.py default --memory-size
+startSeconds      = 0.3      # interpreter start up and tag tables allocation
+reqBaseSeconds    = 2.5e-6   # trace parsing and request set up
+reqLevelSeconds   = 2.8e-6   # per table level walked
+reqWaySeconds     = 0.2e-6   # per cache way looked up
+
+# estimated number of records in a trace, from the size of its first lines
+traceLengths = {}
+def trace_length (fname):
+    if fname not in traceLengths:
+        size = os.path.getsize(fname)
+        with open(fname, 'rb') as f:
+            sample = f.read(2**20)
+        lines = max(sample.count(b'\n'), 1)
+        traceLengths[fname] = int(size * lines / max(len(sample), 1))
+    return traceLengths[fname]
+
+# predicted peak resident memory in bytes of a simulation
+# tables use 1 byte of bytearray per tag bit, see TagCache.Mem
+def predict_memory (simConf, memsize=memSize):
+    tableBytes = 0
+    tableBits  = memsize // 8
+    for gf in simConf.cacheStruct[1:]:
+        tableBytes += tableBits
+        tableBits //= gf
+    tableBytes += tableBits
+    cacheLines = simConf.cacheSize // (simConf.cacheLineSize // 8)
+    return interpreterBytes + tableBytes + cacheLines * cacheLineBytes
+
+# predicted runtime in seconds of a simulation
+def predict_runtime (simConf):
+    perReq  = reqBaseSeconds
+    perReq += reqLevelSeconds * len(simConf.cacheStruct)
+    perReq += reqWaySeconds * simConf.cacheAssoc
+    return startSeconds + trace_length(simConf.inputFile) * perReq
+
+# physical memory of the machine in bytes
+def physical_memory ():
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+# Job class
+class Job:
+    """a simulation to schedule, with its predicted cost"""
+    def __init__ (self, simConf, memory, runtime):
+        self.simConf  = simConf
+        self.memory   = memory  # predicted peak bytes
+        self.runtime  = runtime # predicted seconds
+        self.start    = None
+        self.end      = None
+        self.ok       = None
+        self.rss      = None    # measured peak bytes, if run_fn reports it
+
+    def __str__ (self):
+        return ("{:s}, mem: {:d}MiB, runtime: {:.1f}s".format(self.simConf.taskName(), self.memory >> 20, self.runtime))
+
+# Scheduler class
+class Scheduler:
+    """packs simulations under a memory budget, longest predicted first"""
+
+    # Scheduler constructor
+    def __init__ (
+            self,
+            memBudget=None, # size in bytes, defaults to 80% of physical memory
+            cores=None,     # defaults to the number of cpus
+            verbose=False):
+        if memBudget is None:
+            memBudget = int(0.8 * physical_memory())
+        if cores is None:
+            cores = multiprocessing.cpu_count()
+        self.memBudget = memBudget
+        self.cores     = cores
+        self.verbose   = verbose
+        self.jobs      = []
+        self.wallStart = None
+        self.wallEnd   = None
+
+    # private print method
+    def __print(self,msg):
+        if self.verbose:
+            print(msg)
+        else:
+            return None
+
+    def add (self, simConf):
+        job = Job(simConf, predict_memory(simConf), predict_runtime(simConf))
+        self.jobs.append(job)
+        return job
+
+    # run every job through run_fn(simConf), a blocking call returning False
+    # on failure, or a dict whose 'maxrss' is the job's measured peak memory in
+    # bytes. Returns True if all jobs succeeded.
+    def run (self, run_fn):
+        # longest processing time first
+        pending = sorted(self.jobs, key=lambda j: (-j.runtime, -j.memory))
+        done = queue.Queue()
+        running = []
+        freeMem = self.memBudget
+
+        def worker (job):
+            job.start = time.time()
+            try:
+                result = run_fn(job.simConf)
+                job.ok = result is not False
+                if isinstance(result, dict):
+                    job.rss = result.get('maxrss')
+            except Exception as e:
+                print("{:s}: {:s}".format(job.simConf.taskName(), str(e)))
+                job.ok = False
+            job.end = time.time()
+            done.put(job)
+
+        self.wallStart = time.time()
+        while pending or running:
+            # start the longest jobs that fit the free memory and cores
+            started = True
+            while started and len(running) < self.cores:
+                started = False
+                for job in pending:
+                    # a job larger than the whole budget runs on its own
+                    if job.memory <= freeMem or not running:
+                        if job.memory > self.memBudget:
+                            print("{:s}: predicted memory exceeds the budget, running alone".format(job.simConf.taskName()))
+                        pending.remove(job)
+                        running.append(job)
+                        freeMem -= job.memory
+                        self.__print("start {:s}".format(str(job)))
+                        threading.Thread(target=worker, args=(job,)).start()
+                        started = True
+                        break
+            job = done.get()
+            running.remove(job)
+            freeMem += job.memory
+            self.__print("done {:s} in {:.1f}s".format(str(job), job.end - job.start))
+        self.wallEnd = time.time()
+        return all(j.ok for j in self.jobs)
+
+    # public reporting function
+    def report_str (self):
+        if not self.jobs or self.wallEnd is None:
+            return "no jobs run"
+        wall = max(self.wallEnd - self.wallStart, 1e-9)
+        busy = sum(j.end - j.start for j in self.jobs)
+        predicted = sum(j.runtime for j in self.jobs)
+        # jobs without a measurement (e.g. served from the result store) count as predicted
+        actual = lambda j: j.memory if j.rss is None else j.rss
+        measured = [j for j in self.jobs if j.rss is not None]
+        rptstr  = "jobs: {:d}, failed: {:d}".format(len(self.jobs), len([j for j in self.jobs if not j.ok]))
+        rptstr += ", wall: {:.1f}s, cores: {:d}, coreUtilisation: {:6f}".format(wall, self.cores, busy / (wall * self.cores))
+        rptstr += ", memBudget: {:d}MiB".format(self.memBudget >> 20)
+        rptstr += ", peakPredictedMem: {:d}MiB, memUtilisation: {:6f}".format(self.__peak_mem(lambda j: j.memory) >> 20, self.__mem_utilisation(lambda j: j.memory, wall))
+        rptstr += ", peakActualMem: {:d}MiB, actualMemUtilisation: {:6f}".format(self.__peak_mem(actual) >> 20, self.__mem_utilisation(actual, wall))
+        rptstr += ", measuredJobs: {:d}, predictedJobMem: {:d}MiB, actualJobMem: {:d}MiB".format(len(measured), sum(j.memory for j in measured) >> 20, sum(j.rss for j in measured) >> 20)
+        rptstr += ", predictedRuntime: {:.1f}s, actualRuntime: {:.1f}s".format(predicted, busy)
+        return rptstr
+
+    # private helper method, peak of the memory in use over time from job
+    # start/end events, with mem(job) the memory of a job
+    def __peak_mem(self, mem):
+        events = sorted([(j.start, mem(j)) for j in self.jobs] + [(j.end, -mem(j)) for j in self.jobs], key=lambda e: (e[0], e[1]))
+        inUse = peak = 0
+        for (_, m) in events:
+            inUse += m
+            peak = max(peak, inUse)
+        return peak
+
+    def __mem_utilisation(self, mem, wall):
+        return sum(mem(j) * (j.end - j.start) for j in self.jobs) / (wall * self.memBudget)
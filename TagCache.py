@@ -28,6 +28,7 @@
 #
 
 import math
+import bisect
 from collections import defaultdict
 
 # util functions to turn a string of '0' and '1' into a bytearray and vice versa
@@ -49,11 +50,17 @@ class Cache:
     # internall cache record type
     class Record:
         """content of the tagCache"""
-        def __init__ (self, linesize=1024, dataLineAccessed=set(), valid=False, dirty=False, tableaddr=(0,0)):
+        def __init__ (self, linesize=1024, dataLineAccessed=set(), valid=False, dirty=False, tableaddr=(0,0), prefetcher=None):
             self.valid            = valid
             self.dirty            = dirty
             self.tableaddr        = tableaddr # tuple (tablelvl, lineNumber)
             self.dataLineAccessed = dataLineAccessed
+            # prefetched lines: who brought them in, and when
+            self.prefetcher       = prefetcher
+            self.used             = False
+            self.issued           = None
+            self.ready            = None
+            self.victim           = None # demand line evicted by this prefetch
 
         def __str__ (self):
             return ("valid:%s, dirty:%s, addr:(lvl:%d,lineNumber:0x%x(%d)), temporal_hit:%s" % (self.valid,self.dirty,self.tableaddr[0],self.tableaddr[1],self.tableaddr[1],self.temporal_hits))
@@ -65,19 +72,27 @@ class Cache:
             assoc=4,
             linesize=1024, # size in bits
             spatial_temporal=False,
-            verbose=False):
+            verbose=False,
+            backing=None, # optional backing memory timing model (e.g. a DRAM)
+            prefetchers=[]):
         # attributes
         self.size             = size
         self.assoc            = assoc
         self.linesize         = linesize
         self.spatial_temporal = spatial_temporal
         self.verbose          = verbose
+        self.backing          = backing
+        self.prefetchers      = prefetchers
+        # byte address of each table level in the backing memory, set by Mem
+        self.tableBases       = None
         # derived attributes
         self.waysize = self.size / self.assoc
         self.waylines = int(self.waysize / (self.linesize / 8))
         self.cache = [[Cache.Record(self.linesize) for y in range(self.assoc)] for z in range(self.waylines)]
         # private way counter for replacement policy
         self.__nextWay = 0
+        # request counter, to tell late prefetches without a timing model
+        self.requests         = 0
         # counters for statistics
         self.reportIndex      = 0
         self.cacheHits        = 0
@@ -102,6 +117,11 @@ class Cache:
                 lookup = (True,w,r)
         return lookup
 
+    # private helper method for the byte address of a line in backing memory
+    def __line_addr(self, lvl, lineNumber):
+        base = lvl << 40 if self.tableBases is None else self.tableBases[lvl]
+        return base + lineNumber * (self.linesize // 8)
+
     # private helper method for replacement policy
     def __replace_way(self, lvl, lineNumber):
         # TODO LRU / random / pseudo-random...
@@ -113,7 +133,7 @@ class Cache:
     # XXX We curently do not model the layout of tables in actual memory
     # XXX This means that we neglect effects of how these tables alias with each other
     # XXX In the current model, each level of the table conceptually starts on a cache size aligned address
-    def __fill(self, lvl,lineNumber):
+    def __fill(self, lvl,lineNumber, prefetcher=None):
         # first look for empty entry and fill it if found
         # for w, r in enumerate(self.cache[lineNumber%self.waylines]):
         #     if not r.valid:
@@ -122,13 +142,30 @@ class Cache:
         # else:
         #     w = self.__replace_way(lvl,lineNumber)
         w = self.__replace_way(lvl,lineNumber)
+        victim = self.cache[lineNumber%self.waylines][w]
         # track writeback
-        if self.cache[lineNumber%self.waylines][w].dirty:
+        if victim.dirty:
             self.cacheWritebacks += 1
+            if prefetcher is not None:
+                prefetcher.trafficBytes += self.linesize // 8
+            if self.backing is not None:
+                self.backing.tag_write(self.__line_addr(victim.tableaddr[0],victim.tableaddr[1]), self.linesize // 8)
         #if (lineNumber%self.waylines == 1):
             self.__print("filled line %x, way %d" % (lineNumber%self.waylines,w))
+        # track prefetches evicted before use, and demand lines evicted by
+        # prefetches, the latter only while the prefetched line is unused
+        evicted = None
+        if victim.valid and self.prefetchers:
+            if victim.prefetcher is not None and not victim.used:
+                victim.prefetcher.unused += 1
+                victim.prefetcher.victims.pop(victim.victim, None)
+            elif prefetcher is not None:
+                evicted = victim.tableaddr
         # fill the cache entry
-        rec = Cache.Record (self.linesize, set(), True, False, (lvl,lineNumber))
+        rec = Cache.Record (self.linesize, set(), True, False, (lvl,lineNumber), prefetcher)
+        if evicted is not None:
+            rec.victim = evicted
+            prefetcher.victims[evicted] = rec
         self.cache[lineNumber%self.waylines][w] = rec
         return rec
 
@@ -137,21 +174,87 @@ class Cache:
         lineNumber = bitAddr >> int(math.log(self.linesize,2))
         self.__print("cache access: bitAddr %x, lineNumber %x" % (bitAddr,lineNumber))
         hit, way, r = self.__hit(lvl,lineNumber)
+        trigger = not hit
         if not hit:
+            for p in self.prefetchers:
+                if (lvl,lineNumber) in p.victims:
+                    p.polluting += 1
+                    p.victims.pop((lvl,lineNumber)).victim = None
             r = self.__fill(lvl,lineNumber)
             if create==False:
                 self.cacheMisses += 1
+                if self.backing is not None:
+                    self.backing.tag_read(self.__line_addr(lvl,lineNumber), self.linesize // 8)
         else:
-            self.cacheHits += 1
-            if countAccess:
-                if self.spatial_temporal:
-                    if dataLineAddr >> 6 in r.dataLineAccessed:
-                        self.temporalHits[lvl] += 1
-                    else:
-                        self.spatialHits[lvl] += 1
-                        r.dataLineAccessed.add(dataLineAddr >> 6)
+            late = False
+            # first demand use of a prefetched line
+            if r.prefetcher is not None and not r.used:
+                r.used = True
+                trigger = True
+                late = self.__prefetch_hit(r)
+            if late:
+                # the demand waited for the line, a late prefetch hides no miss
+                if create==False:
+                    self.cacheMisses += 1
+            else:
+                self.cacheHits += 1
+                if countAccess:
+                    if self.spatial_temporal:
+                        if dataLineAddr >> 6 in r.dataLineAccessed:
+                            self.temporalHits[lvl] += 1
+                        else:
+                            self.spatialHits[lvl] += 1
+                            r.dataLineAccessed.add(dataLineAddr >> 6)
         if write:
             r.dirty = True
+        # prefetchers train on misses and on first uses of prefetched lines
+        if trigger:
+            for p in self.prefetchers:
+                for (plvl, pline) in p.on_access(lvl, lineNumber):
+                    self.prefetch(p, plvl, pline)
+
+    # private helper method for the statistics of a demand hit on a prefetched line
+    # returns whether the prefetch was late
+    def __prefetch_hit(self, r):
+        p = r.prefetcher
+        p.victims.pop(r.victim, None)
+        if self.backing is not None:
+            # demand time of this level of the walk
+            now = self.backing.walkReady
+            # the demand waits for the rest of the prefetch fill
+            late = r.ready > now
+            if late:
+                self.backing.tag_wait(r.ready)
+            # walks of different requests overlap, a demand can reach the
+            # line before the walk that prefetched it did
+            p.hiddenLatency += max(0.0, min(r.ready, now) - r.issued)
+        else:
+            late = r.issued == self.requests
+        if late:
+            p.late += 1
+        else:
+            p.useful += 1
+        return late
+
+    # marks the start of a new memory request
+    def start_request(self):
+        self.requests += 1
+
+    # prefetch a line on behalf of prefetcher p, unless it is already cached
+    def prefetch(self, p, lvl, lineNumber):
+        if lineNumber < 0 or self.__hit(lvl,lineNumber)[0]:
+            return
+        evictor = p.victims.pop((lvl,lineNumber), None)
+        if evictor is not None:
+            evictor.victim = None
+        r = self.__fill(lvl,lineNumber,p)
+        p.issued += 1
+        p.trafficBytes += self.linesize // 8
+        if self.backing is not None:
+            r.issued = self.backing.walkReady
+            r.ready  = self.backing.tag_prefetch(self.__line_addr(lvl,lineNumber), self.linesize // 8)
+        else:
+            r.issued = self.requests
 
     def clean(self, lvl, bitAddr):
         lineNumber = bitAddr >> int(math.log(self.linesize,2))
@@ -171,6 +274,401 @@ class Cache:
             rptstr += ", misses: {:d}, writebacks: {:d}".format(self.cacheMisses, self.cacheWritebacks)
             return rptstr
 
+    # public statistics function, same counters as report_str as a dict
+    def report_stats (self, lvls):
+        accesses = self.cacheHits+self.cacheMisses
+        return {
+            'hitRate'       : float(self.cacheHits)/float(accesses) if accesses != 0 else None,
+            'totalAccesses' : self.cacheMisses+self.cacheWritebacks,
+            'hits'          : self.cacheHits,
+            'spatialHits'   : [self.spatialHits[lvl] for lvl in range(0,lvls)],
+            'temporalHits'  : [self.temporalHits[lvl] for lvl in range(0,lvls)],
+            'misses'        : self.cacheMisses,
+            'writebacks'    : self.cacheWritebacks
+        }
+
+# Footprint class
+class Footprint:
+    """A Cache stand-in recording the distinct tag-table lines touched"""
+
+    # Footprint constructor
+    def __init__ (self, linesize=8): # size in bits
+        self.linesize = linesize
+        self.lineShift = int(math.log(self.linesize,2))
+        # set of tuples (tablelvl, lineNumber)
+        self.lines = set()
+
+    # same access interface as the Cache class, no hit/miss modelling
+    def access(self, lvl, bitAddr, write, dataLineAddr, countAccess, create):
+        self.lines.add((lvl, bitAddr >> self.lineShift))
+
+    def clean(self, lvl, bitAddr):
+        return None
+
+    def start_request(self):
+        return None
+
+    # public reporting function
+    def report_str (self, lvls):
+        rptstr = "distinctLines: {:d}".format(len(self.lines))
+        for lvl in range(0,lvls):
+            rptstr += ", distinctLines[{:d}]: {:d}".format(lvl,len([l for l in self.lines if l[0] == lvl]))
+        return rptstr
+
+    def report_stats (self, lvls):
+        return {'distinctLines': [len([l for l in self.lines if l[0] == lvl]) for lvl in range(0,lvls)]}
+
+# Prefetcher classes
+class Prefetcher:
+    """A tag-cache prefetcher, base class issuing no prefetches"""
+
+    name = "none"
+
+    # Prefetcher constructor
+    def __init__ (self, degree=1): # number of lines prefetched per trigger
+        self.degree        = degree
+        # counters for statistics
+        self.issued        = 0
+        self.useful        = 0   # used, and ready in time
+        self.late          = 0   # used, but still in flight
+        self.unused        = 0   # evicted before use
+        self.polluting     = 0   # evicted a line demanded again before its own use
+        self.trafficBytes  = 0   # prefetch fills and the writebacks they caused
+        self.hiddenLatency = 0.0 # in ns, with a backing memory timing model
+        # demand lines evicted by still unused prefetched lines, to track
+        # pollution, maps (tablelvl, lineNumber) to the prefetched Cache.Record
+        self.victims       = {}
+
+    # lines to prefetch on a cache miss or first use of a prefetched line
+    # returns a list of tuples (tablelvl, lineNumber)
+    def on_access (self, lvl, lineNumber):
+        return []
+
+    # lines to prefetch when Mem reads the root table entry of addr as 1,
+    # on reads and writes
+    def on_root (self, mem, addr):
+        return []
+
+    # public reporting function
+    def report_str (self):
+        rptstr =  "prefetch {:s}: issued: {:d}, useful: {:d}, late: {:d}".format(self.name, self.issued, self.useful, self.late)
+        rptstr += ", unused: {:d}, polluting: {:d}, trafficBytes: {:d}".format(self.unused, self.polluting, self.trafficBytes)
+        rptstr += ", hiddenLatency: {:.1f}ns".format(self.hiddenLatency)
+        return rptstr
+
+    # public statistics function
+    def report_stats (self):
+        return {
+            'issued'        : self.issued,
+            'useful'        : self.useful,
+            'late'          : self.late,
+            'unused'        : self.unused,
+            'polluting'     : self.polluting,
+            'trafficBytes'  : self.trafficBytes,
+            'hiddenLatency' : self.hiddenLatency
+        }
+
+class NextLinePrefetcher(Prefetcher):
+    """prefetches the next degree lines of the same table level"""
+
+    name = "next-line"
+
+    def on_access (self, lvl, lineNumber):
+        return [(lvl, lineNumber+i) for i in range(1, self.degree+1)]
+
+class StridePrefetcher(Prefetcher):
+    """prefetches along a line stride seen twice in a row, per table level"""
+
+    name = "stride"
+
+    def __init__ (self, degree=1):
+        Prefetcher.__init__(self, degree)
+        self.lastLine = {}
+        self.stride   = {}
+
+    def on_access (self, lvl, lineNumber):
+        lines = []
+        if lvl in self.lastLine:
+            stride = lineNumber - self.lastLine[lvl]
+            if stride != 0 and stride == self.stride.get(lvl):
+                lines = [(lvl, lineNumber+i*stride) for i in range(1, self.degree+1)]
+            self.stride[lvl] = stride
+        self.lastLine[lvl] = lineNumber
+        return lines
+
+class TableWalkPrefetcher(Prefetcher):
+    """on a root entry read as 1, prefetches the leaf line of the request
+    without waiting for the middle levels of the walk, and the degree-1
+    following leaf lines. Only leaf lines a walk reaches are fetched: the
+    request's own upper entries (root and middle levels) must all be 1, and
+    a following line needs one address it covers whose upper entries are."""
+
+    name = "table-walk"
+
+    # private helper method, whether a walk of an address in [lo, hi)
+    # reaches the leaf level
+    @staticmethod
+    def __reached (mem, lo, hi):
+        if len(mem.tables) == 1:
+            return True
+        (table, shift) = mem.tables[1]
+        for entry in range(lo >> shift, ((hi-1) >> shift) + 1):
+            if table[entry] == 1 and all(t[(entry << shift) >> s] == 1 for (t, s) in mem.tables[2:]):
+                return True
+        return False
+
+    def on_root (self, mem, addr):
+        lines = []
+        leafShift = mem.tables[0][1]
+        lineShift = int(math.log(mem.cache.linesize,2))
+        leafLine  = (addr >> leafShift) >> lineShift
+        if TableWalkPrefetcher.__reached(mem, addr, addr+1):
+            lines.append((0, leafLine))
+        for i in range(1, self.degree):
+            lineAddr = (leafLine+i) << (lineShift+leafShift)
+            if lineAddr >= mem.memsize:
+                break
+            if TableWalkPrefetcher.__reached(mem, lineAddr, min(mem.memsize, lineAddr + (1 << (lineShift+leafShift)))):
+                lines.append((0, leafLine+i))
+        return lines
+
+prefetcherKinds = {
+    NextLinePrefetcher.name : NextLinePrefetcher,
+    StridePrefetcher.name   : StridePrefetcher,
+    TableWalkPrefetcher.name: TableWalkPrefetcher
+}
+
+# DRAM class
+class DRAM:
+    """A backing memory timing model for data and tag-cache traffic"""
+
+    # internal bank and bus state
+    class State:
+        """open rows and busy intervals of a channel"""
+        def __init__ (self, banks):
+            self.openRow  = [None] * banks
+            self.rowOwner = [None] * banks # "data" or "tag", who opened the row
+            # sorted, disjoint (start, end) intervals, accesses are not issued
+            # in time order (walk levels are issued in the future), so an
+            # access can use an idle gap before a later reservation
+            self.bankBusy = [[] for b in range(banks)]
+            self.busBusy  = []
+
+        # drops the intervals over before time t
+        def retire (self, t):
+            for busy in self.bankBusy + [self.busBusy]:
+                n = 0
+                while n < len(busy) and busy[n][1] <= t:
+                    n += 1
+                del busy[:n]
+
+    # DRAM constructor
+    # timings in ns, default to a DDR4-2400 like channel with a 64-bit bus
+    def __init__ (
+            self,
+            banks=16,
+            rowsize=2048,      # row buffer size in bytes
+            burstbytes=64,     # bytes transferred per burst
+            tCAS=14.16,
+            tRCD=14.16,
+            tRP=14.16,
+            tBurst=3.33,       # bus occupancy of one burst
+            reqInterval=10.0,  # time between two data requests of the trace
+            eventLog=None):    # optional file to log every access to (csv)
+        # attributes
+        self.banks       = banks
+        self.rowsize     = rowsize
+        self.burstbytes  = burstbytes
+        self.tCAS        = tCAS
+        self.tRCD        = tRCD
+        self.tRP         = tRP
+        self.tBurst      = tBurst
+        self.reqInterval = reqInterval
+        self.eventLog    = eventLog
+        # state, and the same channel seeing the data traffic only, which
+        # tells how much later data completes because of tag traffic
+        self.now         = 0.0
+        self.state       = DRAM.State(banks)
+        self.shadow      = DRAM.State(banks)
+        # current request
+        self.dataDone    = 0.0
+        self.shadowDone  = 0.0
+        self.tagDone     = 0.0
+        self.walkReady   = 0.0 # a table level can only be read once the level above is known
+        self.pendingWrites = []
+        # per report period statistics, and their history
+        self.timeline    = []
+        self.__new_period()
+
+    def __new_period(self):
+        self.periodStart     = self.now
+        self.dataBytes       = 0
+        self.tagReadBytes    = 0
+        self.tagWriteBytes   = 0
+        self.prefetchBytes   = 0
+        self.rowHits         = 0
+        self.rowMisses       = 0
+        self.rowConflicts    = 0
+        self.dataStallByTag  = 0.0 # delay of data accesses caused by tag traffic
+        self.tagRowConflicts = 0   # data row conflicts on a row opened by tag traffic
+        self.addedLatency    = []  # per request
+        self.dataLatency     = 0.0
+
+    # private helper method reserving the first idle gap of length at least
+    # length from time t in the busy intervals, returns its start
+    # gaps shorter than minGap left around it cannot hold any access and are
+    # merged, which keeps the intervals of a saturated bank or bus short
+    @staticmethod
+    def __reserve(busy, t, length, minGap):
+        i = bisect.bisect_left(busy, (t,))
+        if i > 0 and busy[i-1][1] > t:
+            i -= 1
+        while i < len(busy) and busy[i][0] < t + length:
+            t = max(t, busy[i][1])
+            i += 1
+        (start, end) = (t, t + length)
+        (lo, hi) = (i, i)
+        if lo > 0 and start - busy[lo-1][1] < minGap:
+            lo -= 1
+            start = busy[lo][0]
+        if hi < len(busy) and busy[hi][0] - end < minGap:
+            end = busy[hi][1]
+            hi += 1
+        busy[lo:hi] = [(start, end)]
+        return t
+
+    # private helper method scheduling one access issued at time issue on
+    # state st, returns its completion time and whether the row was a hit,
+    # a miss or a conflict
+    # row buffer state follows the order accesses are scheduled in, not the
+    # order of their start times
+    def __schedule(self, st, addr, nbytes, kind, issue):
+        bank = (addr // self.rowsize) % self.banks
+        row  = addr // (self.rowsize * self.banks)
+        if st.openRow[bank] == row:
+            event = "hit"
+            lat = self.tCAS
+        elif st.openRow[bank] is None:
+            event = "miss"
+            lat = self.tRCD + self.tCAS
+        else:
+            event = "conflict" if st.rowOwner[bank] == kind else "conflict-" + st.rowOwner[bank]
+            lat = self.tRP + self.tRCD + self.tCAS
+        if st.openRow[bank] != row:
+            st.rowOwner[bank] = kind
+        st.openRow[bank] = row
+        bursts = max(1, -(-nbytes // self.burstbytes))
+        # column accesses to an open row are pipelined, the bank is only
+        # held by row activation/precharge and the burst itself
+        start = DRAM.__reserve(st.bankBusy[bank], issue, (lat - self.tCAS) + bursts * self.tBurst, self.tBurst)
+        done  = DRAM.__reserve(st.busBusy, start + lat, bursts * self.tBurst, self.tBurst) + bursts * self.tBurst
+        return (done, event, bank, row)
+
+    # private helper method for one access on the modelled channel
+    def __access(self, addr, nbytes, write, kind, issue):
+        (done, event, bank, row) = self.__schedule(self.state, addr, nbytes, kind, issue)
+        if event == "hit":
+            self.rowHits += 1
+        elif event == "miss":
+            self.rowMisses += 1
+        else:
+            self.rowConflicts += 1
+            if kind == "data" and event == "conflict-tag":
+                self.tagRowConflicts += 1
+        if self.eventLog is not None:
+            self.eventLog.write("{:.2f},{:s},{:s},{:d},{:d},{:.2f}\n".format(issue, kind, "W" if write else "R", bank, row, done - issue))
+        return done
+
+    # data request of the trace, starts a new request
+    def data_access (self, addr, write):
+        self.dataBytes += 64
+        self.dataDone   = self.__access(addr, 64, write, "data", self.now)
+        self.shadowDone = self.__schedule(self.shadow, addr, 64, "data", self.now)[0]
+        self.dataLatency += self.dataDone - self.now
+        self.dataStallByTag += max(0.0, self.dataDone - self.shadowDone)
+        # the table walk starts along with the data access
+        self.tagDone   = self.now
+        self.walkReady = self.now
+
+    # tag line fills are on the request critical path, and each level of the
+    # walk waits for the level above
+    def tag_read (self, addr, nbytes):
+        self.tagReadBytes += nbytes
+        self.walkReady = self.__access(addr, nbytes, False, "tag", self.walkReady)
+        self.tagDone = max(self.tagDone, self.walkReady)
+
+    # tag line prefetches are off the critical path, issued at the current
+    # point of the walk, returns their completion time
+    def tag_prefetch (self, addr, nbytes):
+        self.prefetchBytes += nbytes
+        return self.__access(addr, nbytes, False, "tag", self.walkReady)
+
+    # the current walk waits for an in flight tag line
+    def tag_wait (self, ready):
+        self.walkReady = max(self.walkReady, ready)
+        self.tagDone = max(self.tagDone, ready)
+
+    # tag line writebacks are posted, and drained at the end of the request
+    def tag_write (self, addr, nbytes):
+        self.tagWriteBytes += nbytes
+        self.pendingWrites.append((addr, nbytes))
+
+    # ends the current request, and advances time to the next one
+    # the added latency of a request is how much later than with data traffic
+    # only it completes: its table walk, and the queueing behind tag traffic
+    def end_request (self):
+        self.addedLatency.append(max(0.0, max(self.dataDone, self.tagDone) - self.shadowDone))
+        for (addr, nbytes) in self.pendingWrites:
+            self.__access(addr, nbytes, True, "tag", self.now)
+        self.pendingWrites = []
+        self.now += self.reqInterval
+        # later accesses are all issued from now on
+        self.state.retire(self.now)
+        self.shadow.retire(self.now)
+
+    # closes the current report period, returns its statistics
+    def end_period (self):
+        elapsed = self.now - self.periodStart
+        lats = sorted(self.addedLatency)
+        n = len(lats)
+        accesses = self.rowHits + self.rowMisses + self.rowConflicts
+        period = {
+            'time'            : elapsed,
+            'requests'        : n,
+            'tagReadBytes'    : self.tagReadBytes,
+            'tagWriteBytes'   : self.tagWriteBytes,
+            'prefetchBytes'   : self.prefetchBytes,
+            'dataBytes'       : self.dataBytes,
+            # bytes per ns is GB/s
+            'tagBandwidth'    : (self.tagReadBytes + self.tagWriteBytes + self.prefetchBytes) / elapsed if elapsed > 0 else 0.0,
+            'dataBandwidth'   : self.dataBytes / elapsed if elapsed > 0 else 0.0,
+            'avgDataLatency'  : self.dataLatency / n if n > 0 else 0.0,
+            'avgAddedLatency' : sum(lats) / n if n > 0 else 0.0,
+            'p99AddedLatency' : lats[min(n-1, int(0.99*n))] if n > 0 else 0.0,
+            'maxAddedLatency' : lats[-1] if n > 0 else 0.0,
+            'rowHitRate'      : float(self.rowHits) / accesses if accesses > 0 else 0.0,
+            'dataStallByTag'  : self.dataStallByTag,
+            'tagRowConflicts' : self.tagRowConflicts
+        }
+        self.timeline.append(period)
+        self.__new_period()
+        return period
+
+    # public reporting function, closes the current report period
+    def report_str (self):
+        p = self.end_period()
+        rptstr =  "dram {:d}: time: {:.1f}ns, requests: {:d}".format(len(self.timeline), p['time'], p['requests'])
+        rptstr += ", tagBandwidth: {:.4f}GB/s, dataBandwidth: {:.4f}GB/s".format(p['tagBandwidth'], p['dataBandwidth'])
+        rptstr += ", tagReadBytes: {:d}, tagWriteBytes: {:d}, prefetchBytes: {:d}".format(p['tagReadBytes'], p['tagWriteBytes'], p['prefetchBytes'])
+        rptstr += ", avgDataLatency: {:.2f}ns".format(p['avgDataLatency'])
+        rptstr += ", avgAddedLatency: {:.2f}ns, p99AddedLatency: {:.2f}ns, maxAddedLatency: {:.2f}ns".format(p['avgAddedLatency'], p['p99AddedLatency'], p['maxAddedLatency'])
+        rptstr += ", rowHitRate: {:6f}, dataStallByTag: {:.1f}ns, tagRowConflicts: {:d}".format(p['rowHitRate'], p['dataStallByTag'], p['tagRowConflicts'])
+        return rptstr
+
+    # public statistics function, last closed report period
+    def report_stats (self):
+        return dict(self.timeline[-1]) if self.timeline else {}
+
 # TagCache request type
 class Request:
     """tagCache request format"""
@@ -198,7 +696,10 @@ class Mem:
             spatial_temporal=False,
             emptyLeafOpt=False,
             non_dirty_writes=False,
-            verbose=False):
+            verbose=False,
+            cache=None, # optional pre-built cache model (e.g. a Footprint)
+            dram=None, # optional backing memory timing model (e.g. a DRAM)
+            prefetchers=[]): # tag cache prefetchers (e.g. a NextLinePrefetcher)
         """simulator constructor"""
 
         # assertions to ensure correct operation
@@ -217,8 +718,12 @@ class Mem:
         self.emptyLeafOpt     = emptyLeafOpt
         self.non_dirty_writes = non_dirty_writes
         self.totalMemTransactions = 0
+        self.dram             = dram
+        self.prefetchers      = prefetchers
         # cache
-        self.cache       = Cache (cachesize, cacheassoc, cachelinesize, spatial_temporal, verbose)
+        if cache is None:
+            cache = Cache (cachesize, cacheassoc, cachelinesize, spatial_temporal, verbose, dram, prefetchers)
+        self.cache       = cache
 
         ##################
         # table memories #
@@ -240,6 +745,13 @@ class Mem:
             self.tables[lvl+1] = (bytearray(int(len(self.tables[lvl][0])/gf)),(self.tables[lvl][1]+int(math.log(gf,2))))
             s = len(self.tables[lvl+1][0])
             self.__print("table lvl %d size = 0x%x(%d) bits, 0x%x(%d) bytes, addrShift: %d" % (lvl+1,s,s,int(s/8),int(s/8),self.tables[lvl+1][1]))
+        # for backing memory timing, tables are laid out after the data memory, from leaf to root
+        bases = []
+        base = memstart + memsize
+        for (table, _) in self.tables:
+            bases.append(base)
+            base += len(table) // 8
+        self.cache.tableBases = bases
 
     # private print method
     def __print(self,msg):
@@ -262,13 +774,39 @@ class Mem:
             addrs.append((lvl, bitAddr))
         return addrs
 
-    # public report function
+    # public report functions
+    def report_lines (self):
+        lines = [str(self.tableHits),
+                 "{}, totalMemTransactions: {:d}".format(self.cache.report_str(len(self.tables)),self.totalMemTransactions)]
+        for p in self.prefetchers:
+            lines.append(p.report_str())
+        if self.dram is not None:
+            lines.append(self.dram.report_str())
+        return lines
     def report (self):
-        print(self.tableHits)
-        print("{}, totalMemTransactions: {:d}".format(self.cache.report_str(len(self.tables)),self.totalMemTransactions))
+        for line in self.report_lines():
+            print(line)
+    def stats (self):
+        stats = self.cache.report_stats(len(self.tables))
+        stats['tableHits'] = list(self.tableHits)
+        stats['totalMemTransactions'] = self.totalMemTransactions
+        if self.prefetchers:
+            stats['prefetch'] = dict((p.name, p.report_stats()) for p in self.prefetchers)
+        if self.dram is not None:
+            stats['dram'] = self.dram.report_stats()
+        return stats
+    # private helper method, prefetches on a root table entry read as 1
+    def __walk_ahead(self, addr):
+        for p in self.prefetchers:
+            for (plvl, pline) in p.on_root(self, addr):
+                self.cache.prefetch(p, plvl, pline)
+
     # memory request interface
     def putReq (self, req):
         self.totalMemTransactions += 1
+        self.cache.start_request()
+        if self.dram is not None:
+            self.dram.data_access(req.addr, req.write)
         #self.__print("putting request %s" % str(req))
         req.addr = req.addr - self.memstart
         responseLevel = len(self.tables) - 1
@@ -300,6 +838,9 @@ class Mem:
                                 createNext = self.emptyLeafOpt
                             self.cache.access(lvl, bitAddr, doCacheUpdate, req.addr, False, createMe)
                             #self.__filterPrint(req.addr, "addr: %x performed write (writeDifferent: %r) in upper level %d, table index %x" % (req.addr, doCacheUpdate, lvl, bitAddr))
+                            # walk ahead prefetchers look at the root entry
+                            if table[bitAddr] == 1 and lvl == len(self.tables) - 1:
+                                self.__walk_ahead(req.addr)
                             table[bitAddr] = 1
                             responseLevel -= 1
                 if keepGoing:
@@ -353,8 +894,14 @@ class Mem:
                             responseLevel -= 1
                             #self.__filterPrint(req.addr, "addr: %x read 1 in level %d, table index %x : %s" % (req.addr, lvl, bitAddr, groupStr))
                         self.cache.access(lvl, bitAddr, False, req.addr, not keepGoing, False)
+                        # walk ahead prefetchers look at the root entry
+                        if keepGoing and lvl == len(self.tables) - 1:
+                            self.__walk_ahead(req.addr)
             self.tableHits[responseLevel] += 1
             #self.__print (responseLevel)
 
         else:
             print ("memory out-of-range access")
+
+        if self.dram is not None:
+            self.dram.end_request()
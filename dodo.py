@@ -29,11 +29,18 @@
 
 import re
 import os
+import json
+import shutil
+import hashlib
+import tempfile
 import os.path as op
 import subprocess as sub
 from collections import defaultdict
+from doit import create_after
 from doit.task import clean_targets
 from doit.action import CmdAction
+from SweepScheduler import Scheduler
+from simulateDaemon import submit
 #import multiprocessing as mp
 #from doit.tools import run_once
 
@@ -56,6 +63,18 @@ outputDirs = [allptrs_out_dir,codeptrs_out_dir,zeroes_out_dir]
 usepypy = True
 pypy = op.join("pypy")
 tagSim = op.join(cdir,"simulateTags.py")
+tagLib = op.join(cdir,"TagCache.py")
+tagFootprint = op.join(cdir,"traceFootprint.py")
+
+# content-addressed result store, shared across output directories and graphs
+# (point TAGSIM_RESULT_STORE at a common directory to share it across checkouts)
+resultStore = os.environ.get("TAGSIM_RESULT_STORE", op.join(cdir,"result-store"))
+# umask read once at load time, os.umask can only be read by setting it
+processUmask = os.umask(0)
+os.umask(processUmask)
+
+# socket of a running simulateDaemon.py to submit simulations to, if any
+simDaemon = os.environ.get("TAGSIM_DAEMON")
 
 # confs
 class SimConf:
@@ -204,6 +223,145 @@ simConfs = [SimConf(ac,b,aa,ab,c,d,e,f,g)
                 or ("octane-big" == aa and c == 262144 and d == 512 and e == 8 and len(f) < 3 and g == "no-opt")
           ]
 
+################################################################################
+# Result store #
+################################################################################
+
+# simulator arguments for a given configuration, without interpreter nor input
+def sim_args (simConf):
+    args  = ["--tag-cache-struct"]+[x for x in map(str,simConf.cacheStruct)]
+    args += ["--tag-cache-size",str(simConf.cacheSize)]
+    args += ["--tag-cache-assoc",str(simConf.cacheAssoc)]
+    args += ["--tag-cache-line-size",str(simConf.cacheLineSize)]
+    if simConf.cacheOpt == "all-opt" or simConf.cacheOpt == "non-dirty-writes":
+        args += ["--tag-cache-non-dirty-writes"]
+    if simConf.cacheOpt == "all-opt" or simConf.cacheOpt == "create-destroy-empty":
+        args += ["--tag-cache-create-destroy-empty"]
+    args += ["--tag-cache-count-spatial-temporal"]
+    return args
+
+def hash_file (fname):
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# traces are big, only hash them once per (path, size, mtime)
+traceHashes = {}
+def hash_trace (fname):
+    st = os.stat(fname)
+    k = (op.abspath(fname), st.st_size, st.st_mtime)
+    if k not in traceHashes:
+        traceHashes[k] = hash_file(fname)
+    return traceHashes[k]
+
+# the simulator "version" is the content of the model and of its driver
+def sim_version ():
+    return hash_file(tagLib) + hash_file(tagSim)
+
+def result_key (simConf):
+    key = {
+        'trace'  : hash_trace(simConf.inputFile),
+        'args'   : sim_args(simConf),
+        'version': sim_version()
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def result_path (key):
+    return op.join(resultStore, key[:2], key)
+
+def has_result (key):
+    entry = result_path(key)
+    return op.exists(entry+".out") and op.exists(entry+".err")
+
+# copy a stored result to the task targets, returns False on store miss
+def fetch_result (simConf, key):
+    entry = result_path(key)
+    if not has_result(key):
+        return False
+    shutil.copyfile(entry+".out", simConf.outputFile())
+    shutil.copyfile(entry+".err", simConf.outputFile()+".err")
+    return True
+
+# atomically publish the task targets into the store
+def store_result (simConf, key):
+    entry = result_path(key)
+    os.makedirs(op.dirname(entry), exist_ok=True)
+    for src, ext in [(simConf.outputFile(),".out"), (simConf.outputFile()+".err",".err")]:
+        fd, tmp = tempfile.mkstemp(dir=op.dirname(entry))
+        os.close(fd)
+        shutil.copyfile(src, tmp)
+        # mkstemp creates 0600 files, entries must be readable by other store users
+        os.chmod(tmp, 0o666 & ~processUmask)
+        os.rename(tmp, entry+ext)
+
+################################################################################
+# Trace footprints #
+################################################################################
+
+def footprint_file (inputFile):
+    return inputFile+"-footprint.json"
+
+def sim_sets (simConf):
+    return (simConf.cacheSize // simConf.cacheAssoc) // (simConf.cacheLineSize // 8)
+
+# map each simulation whose results are implied by another simulation of the
+# sweep to that simulation. A configuration with at least as many sets as the
+# trace's conflict free threshold never evicts, so all such configurations
+# sharing input, line size, struct and optimisations produce the same output.
+def implied_sims (sims):
+    minSets = {}
+    for inputFile in set([s.inputFile for s in sims]):
+        if op.exists(footprint_file(inputFile)):
+            with open(footprint_file(inputFile)) as f:
+                for e in json.load(f)['footprint']:
+                    k = (inputFile, tuple(e['struct']), e['non_dirty_writes'], e['line_size'])
+                    minSets[k] = e['min_sets']
+    groups = defaultdict(list)
+    for sim in sims:
+        nonDirty = sim.cacheOpt == "all-opt" or sim.cacheOpt == "non-dirty-writes"
+        threshold = minSets.get((sim.inputFile, tuple(sim.cacheStruct), nonDirty, sim.cacheLineSize))
+        if threshold is not None and sim_sets(sim) >= max(threshold,1):
+            groups[(sim.inputFile, tuple(sim.cacheStruct), sim.cacheOpt, sim.cacheLineSize)].append(sim)
+    implied = {}
+    for group in groups.values():
+        group.sort(key=lambda s: (s.cacheSize, s.cacheAssoc, s.outputDir))
+        for sim in group[1:]:
+            implied[sim.taskName()] = group[0]
+    return implied
+
+def task_footprint () :
+    """index the tag-table lines touched by each trace"""
+
+    def footprint (inputFile, structs, lineSizes):
+        if usepypy:
+            run_cmd = [pypy, tagFootprint]
+        else:
+            run_cmd = [tagFootprint]
+        for struct in structs:
+            run_cmd += ["--tag-cache-struct"]+[x for x in map(str,struct)]
+        run_cmd += ["--tag-cache-line-size"]+[x for x in map(str,lineSizes)]
+        run_cmd += ["-o",footprint_file(inputFile)]
+        run_cmd += [inputFile]
+        a = sub.Popen(run_cmd)
+        a.wait()
+        return a.returncode == 0
+
+    for inputFile in set([s.inputFile for s in simConfs]):
+        sims = [s for s in simConfs if s.inputFile == inputFile]
+        structs = sorted(set([tuple(s.cacheStruct) for s in sims]))
+        lineSizes = sorted(set([s.cacheLineSize for s in sims]))
+        yield {
+            'name'    : inputFile,
+            'actions' : [(footprint,[inputFile,structs,lineSizes])],
+            # implied_sims trusts the index, rebuild it when the walks change
+            'file_dep': [inputFile,tagLib,tagFootprint],
+            'targets' : [footprint_file(inputFile)],
+            'clean'   : [clean_targets],
+            'verbosity':2
+        }
+
 ################################################################################
 # Show configuration task #
 ################################################################################
@@ -225,33 +383,83 @@ def task_show_conf():
 ################################################################################
 # Run simulations #
 ################################################################################
-def task_run_sim () :
-    """runs the simulation for the given parameters"""
+def run_sim (simConf):
+    if usepypy:
+        run_cmd = [pypy, tagSim]
+    else:
+        run_cmd = [tagSim]
+    run_cmd += sim_args(simConf)
+    run_cmd += [simConf.inputFile]
 
-    def run_sim (simConf):
-        if usepypy:
-            run_cmd = [pypy, tagSim]
-        else:
-            run_cmd = [tagSim]
-        run_cmd += ["--tag-cache-struct"]+[x for x in map(str,simConf.cacheStruct)]
-        run_cmd += ["--tag-cache-size",str(simConf.cacheSize)]
-        run_cmd += ["--tag-cache-assoc",str(simConf.cacheAssoc)]
-        run_cmd += ["--tag-cache-line-size",str(simConf.cacheLineSize)]
-        if simConf.cacheOpt == "all-opt" or simConf.cacheOpt == "non-dirty-writes":
-            run_cmd += ["--tag-cache-non-dirty-writes"]
-        if simConf.cacheOpt == "all-opt" or simConf.cacheOpt == "create-destroy-empty":
-            run_cmd += ["--tag-cache-create-destroy-empty"]
-        run_cmd += ["--tag-cache-count-spatial-temporal"]
-        run_cmd += [simConf.inputFile]
-
-        if not op.exists(simConf.outputDir):
-            os.makedirs(simConf.outputDir)
-        of = open(simConf.outputFile(), 'w')
-        ef = open(simConf.outputFile()+".err", 'w')
+    os.makedirs(simConf.outputDir, exist_ok=True)
+    # serve identical configurations from the result store
+    key = result_key(simConf)
+    if fetch_result(simConf, key):
+        print("{:s}: served from result store ({:s})".format(simConf.taskName(),key))
+        return True
+    of = open(simConf.outputFile(), 'w')
+    ef = open(simConf.outputFile()+".err", 'w')
+    maxrss = None
+    storable = True
+    if simDaemon is not None:
+        # only a "done" reply completes the job, the daemon or its worker
+        # may die half way through the reports
+        returncode = 1
+        job = {'id': simConf.taskName(), 'input': simConf.inputFile, 'args': sim_args(simConf)}
+        for r in submit(simDaemon, [job]):
+            if r['type'] == 'report':
+                of.write('\n'.join(r['lines'])+'\n')
+            elif r['type'] == 'error':
+                ef.write(r['msg']+'\n')
+                storable = False
+            elif r['type'] == 'done':
+                returncode = 0
+                # a long running daemon runs the code it imported at startup
+                storable = r.get('version') == sim_version()
+        if returncode != 0 and storable:
+            ef.write("simulation daemon closed the job without completing it\n")
+    else:
         a = sub.Popen(run_cmd, stdout=of, stderr=ef)
-        a.wait()
+        # reap the simulator ourselves to get its peak resident memory
+        _, status, rusage = os.wait4(a.pid, 0)
+        returncode = os.waitstatus_to_exitcode(status)
+        maxrss = rusage.ru_maxrss * 1024 # kilobytes on linux
+    of.close()
+    ef.close()
+    if returncode != 0:
+        return False
+    if storable:
+        store_result(simConf, key)
+    else:
+        print("{:s}: simulation daemon runs another simulator version, not stored".format(simConf.taskName()))
+    if maxrss is not None:
+        return {'maxrss': maxrss}
+    return True
 
+# results of a configuration implied by another one, see implied_sims
+def copy_sim (fromConf, simConf):
+    os.makedirs(simConf.outputDir, exist_ok=True)
+    print("{:s}: implied by {:s}".format(simConf.taskName(),fromConf.taskName()))
+    shutil.copyfile(fromConf.outputFile(), simConf.outputFile())
+    shutil.copyfile(fromConf.outputFile()+".err", simConf.outputFile()+".err")
+
+@create_after(executed='footprint', target_regex='.*')
+def task_run_sim () :
+    """runs the simulation for the given parameters"""
+
+    implied = implied_sims(simConfs)
     for simConf in simConfs:
+        if simConf.taskName() in implied:
+            fromConf = implied[simConf.taskName()]
+            yield {
+                'name'    : simConf.taskName(),
+                'actions' : [(copy_sim,[fromConf,simConf])],
+                'file_dep': [fromConf.outputFile(),fromConf.outputFile()+".err"],
+                'targets' : [simConf.outputFile(),simConf.outputFile()+".err"],
+                'clean'   : [clean_targets],
+                'verbosity':2
+            }
+            continue
         yield {
             'name'    : simConf.taskName(),
             'actions' : [(run_sim,[simConf])],
@@ -261,6 +469,46 @@ def task_run_sim () :
             'verbosity':2
         }
 
+################################################################################
+# Run simulations packed under a memory budget #
+################################################################################
+def task_sweep () :
+    """runs the pending simulations, packed by predicted memory and runtime"""
+
+    def sweep (mem_budget, cores):
+        implied = implied_sims(simConfs)
+        sched = Scheduler(memBudget=(mem_budget << 20) if mem_budget else None,
+                          cores=cores if cores else None,
+                          verbose=True)
+        # a simulation is pending unless the store holds its result for the
+        # current model, outputs of an older model are run again
+        for simConf in simConfs:
+            if simConf.taskName() in implied:
+                continue
+            os.makedirs(simConf.outputDir, exist_ok=True)
+            if not fetch_result(simConf, result_key(simConf)):
+                sched.add(simConf)
+        ok = sched.run(run_sim)
+        print(sched.report_str())
+        # then fill in the implied configurations, from representatives whose
+        # outputs are those of the current model
+        for simConf in simConfs:
+            fromConf = implied.get(simConf.taskName())
+            if fromConf is not None and has_result(result_key(fromConf)):
+                copy_sim(fromConf, simConf)
+        return ok
+
+    return {
+        'actions' : [(sweep)],
+        'task_dep': ['footprint'],
+        'params'  : [{'name':'mem_budget', 'long':'mem-budget', 'type':int, 'default':0,
+                      'help':"memory budget in MiB (default: 80% of physical memory)"},
+                     {'name':'cores', 'long':'cores', 'type':int, 'default':0,
+                      'help':"number of simulations to run at once (default: number of cpus)"}],
+        'uptodate': [False],
+        'verbosity':2
+    }
+
 ################################################################################
 # Gather simulation results #
 ################################################################################
@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+
+#-
+# Copyright (c) 2017 Jonathan Woodruff
+# Copyright (c) 2017 Alexandre Joannou
+# All rights reserved.
+# 
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory (Department of Computer Science and
+# Technology) under DARPA contract HR0011-18-C-0016 ("ECATS"), as part of the
+# DARPA SSITH research programme.
+#
+# @BERI_LICENSE_HEADER_START@
+#
+# Licensed to BERI Open Systems C.I.C. (BERI) under one or more contributor
+# license agreements.  See the NOTICE file distributed with this work for
+# additional information regarding copyright ownership.  BERI licenses this
+# file to you under the BERI Hardware-Software License, Version 1.0 (the
+# "License"); you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at:
+#
+#   http://www.beri-open-systems.org/legal/license-1-0.txt
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @BERI_LICENSE_HEADER_END@
+#
+
+
+import os
+import sys
+import csv
+import json
+import mmap
+import hashlib
+import socket
+import signal
+import argparse
+import threading
+import socketserver
+import multiprocessing
+import os.path as op
+from array import array
+import TagCache
+import simulateTags
+
+# Protocol: newline separated json objects over a local unix socket.
+#
+# requests:
+#   {"cmd": "load",  "id": ID, "input": TRACE, "mode": "parsed"|"mapped"}
+#   {"cmd": "run",   "id": ID, "input": TRACE, "args": ["--tag-cache-size", "4096", ...]}
+#   {"cmd": "run",   "id": ID, "input": TRACE, "args": {"tag_cache_size": 4096, ...}}
+#   {"cmd": "stats", "id": ID}
+# replies, tagged with the id of their request:
+#   {"id": ID, "type": "loaded", "records": N}
+#   {"id": ID, "type": "report", "index": N, "lines": [...], "stats": {...}}
+#   {"id": ID, "type": "done", "stats": {...}, "version": VERSION}
+#   {"id": ID, "type": "stats", "traces": {...}, "running": N, "done": N, "version": VERSION}
+#   {"id": ID, "type": "error", "msg": "..."}
+#
+# "lines" are the lines simulateTags.py would have printed for that report.
+# VERSION identifies the simulator code the daemon loaded, see code_version.
+
+################################################################################
+# Resident traces #
+################################################################################
+
+# the simulator "version" the daemon runs: the content of the model and of
+# its driver when they were imported, as computed by dodo.py's sim_version
+def code_version ():
+    version = ""
+    for mod in [TagCache, simulateTags]:
+        with open(op.splitext(mod.__file__)[0]+".py", 'rb') as f:
+            version += hashlib.sha256(f.read()).hexdigest()
+    return version
+
+codeVersion = code_version()
+
+# record kinds, shared with the simulateTags.py decoder
+SKIP  = simulateTags.SKIP
+READ  = simulateTags.READ
+WRITE = simulateTags.WRITE
+
+class ParsedTrace:
+    """a trace decoded once into flat arrays"""
+    def __init__ (self, fname):
+        self.kinds = array('B')
+        self.addrs = array('Q')
+        self.tags  = bytearray()
+        for req in simulateTags.trace_requests(csv.reader(open(fname))):
+            if req is None:
+                self.kinds.append(SKIP)
+                self.addrs.append(0)
+                self.tags.extend(bytearray(8))
+            else:
+                self.kinds.append(WRITE if req.write else READ)
+                self.addrs.append(req.addr)
+                self.tags.extend(req.tags if req.write else bytearray(8))
+
+    def __len__ (self):
+        return len(self.kinds)
+
+    # fresh requests on every replay, Mem.putReq rebases req.addr in place
+    def requests (self):
+        for i, kind in enumerate(self.kinds):
+            if kind == WRITE:
+                yield TagCache.Request(True, self.addrs[i], self.tags[8*i:8*i+8])
+            elif kind == READ:
+                yield TagCache.Request(False, self.addrs[i], [])
+            else:
+                yield None
+
+class MappedTrace:
+    """a trace mapped in memory, decoded on every replay"""
+    def __init__ (self, fname):
+        with open(fname, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # count in place, slicing the map would copy the whole trace
+        self.records = 0
+        nl = self.mm.find(b'\n')
+        while nl >= 0:
+            self.records += 1
+            nl = self.mm.find(b'\n', nl + 1)
+
+    def __len__ (self):
+        return self.records
+
+    def __lines (self):
+        pos = 0
+        end = len(self.mm)
+        while pos < end:
+            nl = self.mm.find(b'\n', pos)
+            if nl < 0:
+                nl = end
+            yield self.mm[pos:nl].decode()
+            pos = nl + 1
+
+    def requests (self):
+        return simulateTags.trace_requests(csv.reader(self.__lines()))
+
+traceKinds = {'parsed': ParsedTrace, 'mapped': MappedTrace}
+
+################################################################################
+# Jobs #
+################################################################################
+
+# error raised in a worker, its message is forwarded as is
+class WorkerError(Exception):
+    pass
+
+# simulateTags.py command line options from a dict of option names, e.g.
+# {"tag_cache_size": 4096, "tag-cache-struct": [0,256], "dram": True}
+def dict_argv (opts):
+    argv = []
+    for k, v in sorted(opts.items()):
+        opt = "--" + k.lstrip('-').replace('_','-')
+        action = simulateTags.parser._option_string_actions.get(opt)
+        if action is None:
+            raise ValueError("unknown simulateTags.py argument: {:s}".format(k))
+        if action.nargs == 0: # flags
+            if v:
+                argv.append(opt)
+        elif isinstance(action, argparse._AppendAction):
+            for x in (v if isinstance(v, list) else [v]):
+                argv += [opt, str(x)]
+        elif isinstance(v, list):
+            argv += [opt] + [str(x) for x in v]
+        else:
+            argv += [opt, str(v)]
+    return argv
+
+# simulateTags.py arguments of a job, from a list of command line options or
+# from a dict of option names, both checked by the simulateTags.py parser
+def job_args (job):
+    opts = job.get('args', [])
+    try:
+        if isinstance(opts, list):
+            argv = [str(x) for x in opts]
+        else:
+            argv = dict_argv(opts)
+        # "--" keeps nargs='+' options from swallowing the input
+        args = simulateTags.parser.parse_args(argv + ['--', job['input']])
+    except SystemExit:
+        raise ValueError("invalid simulateTags.py arguments: {:s}".format(" ".join(argv)))
+    # worker stdout is not forwarded
+    args.verbose = False
+    return args
+
+# worker side of a job, runs in a process forked from the daemon
+def run_job (trace, args, conn):
+    # drop every descriptor inherited from the daemon but the job's own pipe
+    # end: its read end, the listening and client sockets, other jobs' pipes.
+    # Holding them would keep a worker orphaned by a killed daemon blocked on
+    # a pipe nobody reads, and its client waiting on an open socket
+    fd = conn.fileno()
+    os.closerange(3, fd)
+    os.closerange(fd + 1, os.sysconf('SC_OPEN_MAX'))
+    try:
+        tagmem = simulateTags.make_mem(args)
+        index = [0]
+        def report ():
+            index[0] += 1
+            conn.send({'type': 'report', 'index': index[0], 'lines': tagmem.report_lines(), 'stats': tagmem.stats()})
+        simulateTags.simulate(tagmem, trace.requests(), args, report)
+        conn.send({'type': 'done', 'stats': tagmem.stats(), 'version': codeVersion})
+    except Exception as e:
+        conn.send({'type': 'error', 'msg': "{:s}: {:s}".format(type(e).__name__, str(e))})
+        raise
+    finally:
+        conn.close()
+
+# Daemon class
+class Daemon:
+    """keeps traces resident and runs jobs on a bounded pool of forked workers"""
+
+    # Daemon constructor
+    def __init__ (self, workers=None, mode='parsed', verbose=False):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.mode     = mode
+        self.verbose  = verbose
+        self.traces   = {}
+        self.loading  = {} # per trace locks, traces load outside of self.lock
+        self.lock     = threading.Lock()
+        self.slots    = threading.BoundedSemaphore(workers)
+        self.running  = 0
+        self.done     = 0
+        # workers are forked so that they share the resident traces
+        self.ctx      = multiprocessing.get_context('fork')
+
+    # private print method
+    def __print(self,msg):
+        if self.verbose:
+            print(msg)
+        else:
+            return None
+
+    def load (self, fname, mode=None):
+        if mode is None:
+            mode = self.mode
+        if mode not in traceKinds:
+            raise ValueError("unknown trace mode: {:s}".format(mode))
+        k = (op.abspath(fname), mode)
+        with self.lock:
+            if k in self.traces:
+                return self.traces[k]
+            keyLock = self.loading.setdefault(k, threading.Lock())
+        with keyLock:
+            with self.lock:
+                if k in self.traces:
+                    return self.traces[k]
+            self.__print("loading {:s} ({:s})".format(fname, mode))
+            trace = traceKinds[mode](fname)
+            with self.lock:
+                self.traces[k] = trace
+                del self.loading[k]
+            return trace
+
+    def run (self, job, send):
+        args = job_args(job)
+        trace = self.load(job['input'], job.get('mode'))
+        with self.slots:
+            with self.lock:
+                self.running += 1
+            recv, conn = self.ctx.Pipe(duplex=False)
+            p = self.ctx.Process(target=run_job, args=(trace, args, conn))
+            p.start()
+            conn.close()
+            finished = False
+            workerError = None
+            try:
+                while True:
+                    try:
+                        msg = recv.recv()
+                    except EOFError:
+                        break
+                    if msg['type'] == 'error':
+                        workerError = msg['msg']
+                        continue
+                    finished = msg['type'] == 'done'
+                    send(msg)
+            finally:
+                recv.close()
+                p.join()
+                with self.lock:
+                    self.running -= 1
+                    self.done += 1
+            if workerError is not None:
+                raise WorkerError(workerError)
+            if not finished:
+                raise WorkerError("worker exited with code {:d}".format(p.exitcode))
+
+    def stats (self):
+        with self.lock:
+            return {'type': 'stats',
+                    'traces': dict(("{:s} ({:s})".format(*k), len(t)) for (k, t) in self.traces.items()),
+                    'running': self.running,
+                    'done': self.done,
+                    'version': codeVersion}
+
+    # handle one request, replies go through send(msg)
+    def serve (self, req, send):
+        rid = req.get('id')
+        def reply (msg):
+            msg['id'] = rid
+            send(msg)
+        try:
+            cmd = req.get('cmd', 'run')
+            if cmd == 'load':
+                reply({'type': 'loaded', 'records': len(self.load(req['input'], req.get('mode')))})
+            elif cmd == 'run':
+                self.run(req, reply)
+            elif cmd == 'stats':
+                reply(self.stats())
+            else:
+                raise ValueError("unknown command: {:s}".format(cmd))
+        except WorkerError as e:
+            reply({'type': 'error', 'msg': str(e)})
+        except Exception as e:
+            reply({'type': 'error', 'msg': "{:s}: {:s}".format(type(e).__name__, str(e))})
+
+class Handler(socketserver.StreamRequestHandler):
+    """one client connection, requests are served concurrently"""
+    def handle (self):
+        lock = threading.Lock()
+        def send (msg):
+            with lock:
+                self.wfile.write((json.dumps(msg)+'\n').encode())
+                self.wfile.flush()
+        threads = []
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                req = json.loads(line.decode())
+            except ValueError as e:
+                send({'id': None, 'type': 'error', 'msg': "invalid request: {:s}".format(str(e))})
+                continue
+            t = threading.Thread(target=self.server.daemon.serve, args=(req, send))
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    def __init__ (self, path, daemon):
+        self.daemon = daemon
+        socketserver.ThreadingUnixStreamServer.__init__(self, path, Handler)
+
+################################################################################
+# Client #
+################################################################################
+
+# send requests to a running daemon, yields the replies as they arrive
+def submit (path, requests):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.connect(path)
+    try:
+        for req in requests:
+            s.sendall((json.dumps(req)+'\n').encode())
+        s.shutdown(socket.SHUT_WR)
+        for line in s.makefile('r'):
+            yield json.loads(line)
+    finally:
+        s.close()
+
+################################################################################
+# Main #
+################################################################################
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='daemon serving cheri tags cache simulations over a local unix socket')
+    parser.add_argument('preload', type=str, nargs='*', metavar='INPUT',
+                        help="INPUT memory traces to load at start up (in csv format)")
+    parser.add_argument('-v', '--verbose', action='store_true', default=False,
+                        help="turn on output messages")
+    parser.add_argument('--socket', type=str, default="tagsim.sock", metavar='SOCKET',
+                        help="specify SOCKET, the unix socket path to listen on (default=tagsim.sock)")
+    parser.add_argument('--workers', type=int, default=None, metavar='WORKERS',
+                        help="specify WORKERS, the number of simulations to run at once (default=number of cpus)")
+    parser.add_argument('--mode', type=str, default='parsed', choices=sorted(traceKinds.keys()),
+                        help="keep traces parsed in memory or mapped and parsed per job (default=parsed)")
+    args = parser.parse_args()
+
+    daemon = Daemon(args.workers, args.mode, args.verbose)
+    for fname in args.preload:
+        daemon.load(fname)
+    if op.exists(args.socket):
+        os.unlink(args.socket)
+    server = Server(args.socket, daemon)
+    signal.signal(signal.SIGTERM, lambda *a: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
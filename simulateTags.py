@@ -32,6 +32,10 @@
 import argparse
 import sys
 import csv
+import mmap
+import struct
+import multiprocessing
+from array import array
 import TagCache
 
 ################################
@@ -70,35 +74,180 @@ parser.add_argument('--tag-cache-create-destroy-empty', action='store_true', def
                     help="turn on optimisation that a first write of a clean node will not read from memory, and the last clear will not write back")
 parser.add_argument('--tag-cache-non-dirty-writes', action='store_true', default=False,
                     help="turn on optimisation keeping line non dirty if writing the same data over again")
+parser.add_argument('--tag-cache-prefetch', type=str, action='append', default=[], choices=sorted(TagCache.prefetcherKinds.keys()), metavar='PREFETCHER',
+                    help="turn on a tag cache PREFETCHER, one of %s, can be repeated" % ", ".join(sorted(TagCache.prefetcherKinds.keys())))
+parser.add_argument('--tag-cache-prefetch-degree', type=auto_int, default=1, metavar='PREFETCHDEGREE',
+                    help="specify PREFETCHDEGREE, the number of lines each prefetcher fetches per trigger (default=1)")
+parser.add_argument('--dram', action='store_true', default=False,
+                    help="turn on the backing DRAM timing model, driven by the data requests and the tag cache fills and writebacks")
+parser.add_argument('--dram-banks', type=auto_int, default=16, metavar='DRAMBANKS',
+                    help="specify DRAMBANKS, the number of DRAM banks (default=16)")
+parser.add_argument('--dram-row-size', type=auto_int, default=2048, metavar='DRAMROWSIZE',
+                    help="specify DRAMROWSIZE, the DRAM row buffer size in bytes (default=2048)")
+parser.add_argument('--dram-burst-bytes', type=auto_int, default=64, metavar='DRAMBURSTBYTES',
+                    help="specify DRAMBURSTBYTES, the bytes transferred per DRAM burst, a tag line takes as many bursts as needed (default=64)")
+parser.add_argument('--dram-timings', type=float, nargs=4, default=[14.16,14.16,14.16,3.33], metavar=('TCAS','TRCD','TRP','TBURST'),
+                    help="specify the DRAM TCAS, TRCD, TRP and TBURST timings in ns (default=14.16 14.16 14.16 3.33)")
+parser.add_argument('--dram-req-interval', type=float, default=10.0, metavar='DRAMREQINTERVAL',
+                    help="specify DRAMREQINTERVAL, the time in ns between two requests of the trace (default=10.0)")
+parser.add_argument('--dram-events', type=str, default=None, metavar='DRAMEVENTS',
+                    help="specify DRAMEVENTS, a csv file to log every DRAM access to (time,kind,op,bank,row,latency)")
+parser.add_argument('--decode-process', action='store_true', default=False,
+                    help="decode the trace in a separate process feeding the simulator through a shared memory ring buffer")
+parser.add_argument('--decode-batch', type=auto_int, default=4096, metavar='DECODEBATCH',
+                    help="specify DECODEBATCH, the number of records per ring buffer batch with --decode-process (default=4096)")
+parser.add_argument('--decode-batches', type=auto_int, default=16, metavar='DECODEBATCHES',
+                    help="specify DECODEBATCHES, the number of batches in the ring buffer with --decode-process (default=16)")
 #parser.add_argument('--ptr-size', type=int, default=64, metavar='PTR_SZ',
 #                    help="pointer size in bits (default 64)")
 
-args = parser.parse_args()
+##################################
+# Trace parsing and replay loop  #
+##################################
 
-if args.verbose:
-    def verboseprint(msg):
-        print(msg)
-else:
-    verboseprint = lambda *a: None
+# record kinds of decoded traces
+SKIP  = 0
+READ  = 1
+WRITE = 2
 
-#
-infile = csv.reader(open(args.input))
+# turn csv trace records into TagCache requests, None for records not modelled
+def trace_requests (rows):
+    for line in rows:
+        # only consider 64 bytes requests
+        if (line[2] == "64"):
+            data = []
+            if (line[0]=="W"):
+                data = TagCache.str2ba(line[3])
+            yield TagCache.Request(line[0]=="W", int(line[1],16), data)
+        else:
+            yield None
 
-########################################
-# Replay traces and simulate tag cache #
-########################################
+# pipelined trace decoding
+# A decoder process parses the csv trace into a shared memory ring of batches.
+# Each batch is a record count followed by the arrays of the records' kinds
+# (1 byte), addresses (8 bytes) and tags (8 bytes), so that the simulator side
+# takes a batch apart with a few slices rather than one unpack per record. A
+# count of 0 marks the end of the trace and a negative count a decoder failure.
+batchHeader = struct.Struct('<i')
+noTags      = bytes(bytearray(8))
 
-# instanciating tag cache memory model for simulation
+# byte offsets of the kinds, addresses and tags arrays in a batch, and its size
+def batch_layout (batch):
+    kindsOff = 8
+    addrsOff = kindsOff + -(-batch // 8) * 8
+    tagsOff  = addrsOff + 8*batch
+    return (kindsOff, addrsOff, tagsOff, tagsOff + 8*batch)
+
+def decode_trace (fname, ring, batch, batches, free, full):
+    (kindsOff, addrsOff, tagsOff, batchSize) = batch_layout(batch)
+    slot = 0
+    kinds = array('B')
+    addrs = array('Q')
+    tags  = bytearray()
+    def publish (count):
+        free.acquire()
+        base = slot*batchSize
+        batchHeader.pack_into(ring, base, count)
+        if count > 0:
+            ring[base+kindsOff:base+kindsOff+count]   = kinds.tobytes()
+            ring[base+addrsOff:base+addrsOff+8*count] = addrs.tobytes()
+            ring[base+tagsOff:base+tagsOff+8*count]   = bytes(tags)
+        full.release()
+    try:
+        for req in trace_requests(csv.reader(open(fname))):
+            if req is None:
+                kinds.append(SKIP)
+                addrs.append(0)
+                tags += noTags
+            elif req.write:
+                kinds.append(WRITE)
+                addrs.append(req.addr)
+                tags += req.tags
+            else:
+                kinds.append(READ)
+                addrs.append(req.addr)
+                tags += noTags
+            if len(kinds) == batch:
+                publish(batch)
+                slot = (slot + 1) % batches
+                kinds = array('B')
+                addrs = array('Q')
+                tags  = bytearray()
+        if len(kinds) != 0:
+            publish(len(kinds))
+            slot = (slot + 1) % batches
+        publish(0)
+    except Exception:
+        # unblock the simulator, the traceback goes to stderr and exit code is 1
+        publish(-1)
+        raise
+
+# same requests as trace_requests, decoded by a separate process
+# Building a request per record costs as much as unpacking it, so one read and
+# one write request are recycled: a yielded request is only valid until the
+# next one is pulled, which is all the simulation loop needs.
+def decoded_requests (fname, batch=4096, batches=16):
+    (kindsOff, addrsOff, tagsOff, batchSize) = batch_layout(batch)
+    # anonymous mappings are only shared with forked children
+    ctx  = multiprocessing.get_context('fork')
+    ring = mmap.mmap(-1, batchSize*batches)
+    free = ctx.Semaphore(batches)
+    full = ctx.Semaphore(0)
+    decoder = ctx.Process(target=decode_trace, args=(fname, ring, batch, batches, free, full))
+    decoder.daemon = True
+    decoder.start()
+    slot = 0
+    readReq  = TagCache.Request(False, 0, [])
+    writeReq = TagCache.Request(True, 0, noTags)
+    try:
+        while True:
+            # never block on a decoder that died without publishing
+            while not full.acquire(timeout=1.0):
+                if not decoder.is_alive():
+                    # it may have published right before exiting
+                    if full.acquire(False):
+                        break
+                    raise RuntimeError("trace decoder exited with code {}".format(decoder.exitcode))
+            base = slot*batchSize
+            count = batchHeader.unpack_from(ring, base)[0]
+            if count == 0:
+                break
+            if count < 0:
+                raise RuntimeError("trace decoder failed decoding {:s}".format(fname))
+            kinds = ring[base+kindsOff:base+kindsOff+count]
+            addrs = array('Q', ring[base+addrsOff:base+addrsOff+8*count])
+            tags  = ring[base+tagsOff:base+tagsOff+8*count]
+            free.release()
+            slot = (slot + 1) % batches
+            for (kind, addr, i) in zip(kinds, addrs, range(0, 8*count, 8)):
+                if kind == WRITE:
+                    writeReq.addr = addr
+                    writeReq.tags = tags[i:i+8]
+                    yield writeReq
+                elif kind == READ:
+                    readReq.addr = addr
+                    yield readReq
+                else:
+                    yield None
+    finally:
+        # the simulation can stop before the end of the trace
+        if decoder.is_alive():
+            decoder.terminate()
+        decoder.join()
+        ring.close()
 
-verboseprint("setting up tag cache model with following parameters:")
-verboseprint("cachesize=%d bytes"%args.tag_cache_size)
-verboseprint("cacheassoc=%d"%args.tag_cache_assoc)
-verboseprint("cachelinesize=%d bits"%args.tag_cache_line_size)
-verboseprint("tablestruct=%s"%args.tag_cache_struct)
-verboseprint("memstart=0x%x"%args.memory_start_addr)
-verboseprint("memsize=%d bytes"%args.memory_size)
-verboseprint("tag cache create/destroy empty nodes without touching memory={}".format(args.tag_cache_create_destroy_empty))
-tagmem = TagCache.Mem(  cachesize=args.tag_cache_size,
+# instanciating tag cache memory model for simulation
+def make_mem (args):
+    dram = None
+    if args.dram:
+        tCAS, tRCD, tRP, tBurst = args.dram_timings
+        dram = TagCache.DRAM(banks=args.dram_banks,
+                             rowsize=args.dram_row_size,
+                             burstbytes=args.dram_burst_bytes,
+                             tCAS=tCAS, tRCD=tRCD, tRP=tRP, tBurst=tBurst,
+                             reqInterval=args.dram_req_interval,
+                             eventLog=open(args.dram_events, 'w') if args.dram_events else None)
+    return TagCache.Mem(cachesize=args.tag_cache_size,
                         cacheassoc=args.tag_cache_assoc,
                         cachelinesize=args.tag_cache_line_size,
                         tablestruct=args.tag_cache_struct,
@@ -107,23 +256,55 @@ tagmem = TagCache.Mem(  cachesize=args.tag_cache_size,
                         spatial_temporal=args.tag_cache_count_spatial_temporal,
                         emptyLeafOpt=args.tag_cache_create_destroy_empty,
                         non_dirty_writes=args.tag_cache_non_dirty_writes,
-                        verbose=args.verbose)
-
-reports = 0
-# simulation loop
-for i, line in enumerate(infile):
-    # only consider 64 bytes requests
-    if (line[2] == "64"):
-        data = []
-        if (line[0]=="W"):
-            data = TagCache.str2ba(line[3])
-        tagmem.putReq(TagCache.Request( line[0]=="W",
-                                        int(line[1],16),
-                                        data))
-    # display report messages periodically
-    if (i%args.report_period)==0:
-        reports += 1
-        tagmem.report()
-
-    if reports > args.report_periods:
-        exit()
+                        verbose=args.verbose,
+                        dram=dram,
+                        prefetchers=[TagCache.prefetcherKinds[p](args.tag_cache_prefetch_degree) for p in args.tag_cache_prefetch])
+
+# simulation loop, calls report periodically (default prints tagmem reports)
+def simulate (tagmem, requests, args, report=None):
+    if report is None:
+        report = tagmem.report
+    reports = 0
+    for i, req in enumerate(requests):
+        if req is not None:
+            tagmem.putReq(req)
+        # display report messages periodically
+        if (i%args.report_period)==0:
+            reports += 1
+            report()
+
+        if reports > args.report_periods:
+            return
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        def verboseprint(msg):
+            print(msg)
+    else:
+        verboseprint = lambda *a: None
+
+    ########################################
+    # Replay traces and simulate tag cache #
+    ########################################
+
+    verboseprint("setting up tag cache model with following parameters:")
+    verboseprint("cachesize=%d bytes"%args.tag_cache_size)
+    verboseprint("cacheassoc=%d"%args.tag_cache_assoc)
+    verboseprint("cachelinesize=%d bits"%args.tag_cache_line_size)
+    verboseprint("tablestruct=%s"%args.tag_cache_struct)
+    verboseprint("memstart=0x%x"%args.memory_start_addr)
+    verboseprint("memsize=%d bytes"%args.memory_size)
+    verboseprint("tag cache create/destroy empty nodes without touching memory={}".format(args.tag_cache_create_destroy_empty))
+    tagmem = make_mem(args)
+
+    if args.decode_process:
+        requests = decoded_requests(args.input, args.decode_batch, args.decode_batches)
+    else:
+        requests = trace_requests(csv.reader(open(args.input)))
+    try:
+        simulate(tagmem, requests, args)
+    finally:
+        requests.close()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+#-
+# Copyright (c) 2017 Jonathan Woodruff
+# Copyright (c) 2017 Alexandre Joannou
+# All rights reserved.
+# 
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory (Department of Computer Science and
+# Technology) under DARPA contract HR0011-18-C-0016 ("ECATS"), as part of the
+# DARPA SSITH research programme.
+#
+# @BERI_LICENSE_HEADER_START@
+#
+# Licensed to BERI Open Systems C.I.C. (BERI) under one or more contributor
+# license agreements.  See the NOTICE file distributed with this work for
+# additional information regarding copyright ownership.  BERI licenses this
+# file to you under the BERI Hardware-Software License, Version 1.0 (the
+# "License"); you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at:
+#
+#   http://www.beri-open-systems.org/legal/license-1-0.txt
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @BERI_LICENSE_HEADER_END@
+#
+
+
+import argparse
+import csv
+import json
+import TagCache
+
+################################
+# Parse command line arguments #
+################################
+
+parser = argparse.ArgumentParser(description='script indexing the tag-table footprint of a memory trace')
+
+def auto_int (x):
+    return int(x,0)
+
+parser.add_argument('input', type=str, metavar='INPUT',
+                    help="INPUT memory trace to index (in csv format)")
+parser.add_argument('-v', '--verbose', action='store_true', default=False,
+                    help="turn on output messages")
+parser.add_argument('--tag-cache-line-size', type=auto_int, nargs='+', default=[1024], metavar='TAGCACHELINESIZE',
+                    help="specify TAGCACHELINESIZE, the list of tag cache line sizes in bits to index (default=[1024])")
+parser.add_argument('--tag-cache-struct', type=auto_int, nargs='+', action='append', metavar='TAGCACHESTRUCT',
+                    help="specify TAGCACHESTRUCT, a list of branching factors describing the tags tree from leaf to root, can be repeated (default=[0,256])")
+parser.add_argument('--memory-start-addr', type=auto_int, default=0x80000000, metavar='MEMSTARTADDR',
+                    help="specify MEMSTARTADDR, the address at which memory starts (default=0x80000000)")
+parser.add_argument('--memory-size', type=auto_int, default=2**30, metavar='MEMSIZE',
+                    help="specify MEMSIZE, the desired memory size in bytes (default=2**29)")
+parser.add_argument('-o', '--output', type=str, default=None, metavar='OUTPUT',
+                    help="specify OUTPUT, the json file to write the index to (default=stdout)")
+
+args = parser.parse_args()
+if args.tag_cache_struct is None:
+    args.tag_cache_struct = [[0,256]]
+
+if args.verbose:
+    def verboseprint(msg):
+        print(msg)
+else:
+    verboseprint = lambda *a: None
+
+#######################
+# footprint helpers   #
+#######################
+
+# smallest power of two number of cache sets for which no two distinct lines
+# of the footprint share a set. With at most one line per set, the tag cache
+# never evicts anything and behaves exactly like an infinite cache, so every
+# configuration with at least that many sets produces the same results.
+# Returns None if two lines always alias (same line number in two levels).
+def min_conflict_free_sets (lines):
+    if len(lines) == 0:
+        return 1
+    lineNumbers = set(ln for (lvl, ln) in lines)
+    if len(lineNumbers) != len(lines):
+        return None
+    sets = 1
+    while sets < len(lines):
+        sets *= 2
+    while len(set(ln % sets for ln in lineNumbers)) != len(lineNumbers):
+        sets *= 2
+    return sets
+
+########################################
+# Replay trace and record footprints   #
+########################################
+
+# one table walk per struct and per write mode, as the non dirty writes
+# optimisation can change when tables get garbage collected. Each walk holds
+# its own tag tables (memsize/8 bytes for the leaf level alone), so structs
+# are walked one after the other, each replaying the trace once
+minLineSize = min(args.tag_cache_line_size)
+index = {'input': args.input, 'memstart': args.memory_start_addr, 'memsize': args.memory_size, 'footprint': []}
+for struct in args.tag_cache_struct:
+    walks = []
+    for non_dirty_writes in [False, True]:
+        verboseprint("indexing struct=%s, non_dirty_writes=%s" % (struct, non_dirty_writes))
+        walks.append((struct, non_dirty_writes, TagCache.Mem(
+                        tablestruct=struct,
+                        memstart=args.memory_start_addr,
+                        memsize=args.memory_size,
+                        non_dirty_writes=non_dirty_writes,
+                        verbose=args.verbose,
+                        cache=TagCache.Footprint(minLineSize))))
+
+    infile = csv.reader(open(args.input))
+    for line in infile:
+        # only consider 64 bytes requests
+        if (line[2] == "64"):
+            data = []
+            if (line[0]=="W"):
+                data = TagCache.str2ba(line[3])
+            addr = int(line[1],16)
+            for (_,_,tagmem) in walks:
+                tagmem.putReq(TagCache.Request(line[0]=="W", addr, data))
+
+    for (struct, non_dirty_writes, tagmem) in walks:
+        verboseprint("struct=%s, non_dirty_writes=%s: %s" % (struct, non_dirty_writes, tagmem.cache.report_str(len(struct))))
+        for linesize in sorted(set(args.tag_cache_line_size)):
+            shift = (linesize // minLineSize).bit_length() - 1
+            lines = set((lvl, ln >> shift) for (lvl, ln) in tagmem.cache.lines)
+            index['footprint'].append({
+                'struct'          : struct,
+                'non_dirty_writes': non_dirty_writes,
+                'line_size'       : linesize,
+                'distinct_lines'  : [len([l for l in lines if l[0] == lvl]) for lvl in range(len(struct))],
+                'min_sets'        : min_conflict_free_sets(lines)
+            })
+    # drop this struct's tables before walking the next one
+    walks = None
+
+if args.output is None:
+    print(json.dumps(index, indent=1))
+else:
+    with open(args.output, 'w') as outfile:
+        json.dump(index, outfile, indent=1)